@@ -3,11 +3,15 @@
 # drop: - type="text"
 import abc
 import base64
+import bisect
 import datetime
 import fnmatch
+import functools
 import inspect
 import io
+import itertools
 import json
+import os
 import re
 import sys
 import tarfile
@@ -28,6 +32,17 @@ INSTILL_API_VERSION = '0.1.1'
 
 MAX_LINE_LENGTH = 120
 
+# tarfile's default copy buffer (16 KiB) is too small
+TAR_BUFFER_SIZE = 2 * 1024 * 1024
+# copybufsize is only available since python 3.8
+if sys.version_info >= (3, 8):
+    TAR_COPY_KWARGS = {'copybufsize': TAR_BUFFER_SIZE}
+else:
+    TAR_COPY_KWARGS = {}
+
+# buffer size for reading/writing source files
+IO_BUFFER_SIZE = 1024 * 1024
+
 def get_max_line_length():
     return MAX_LINE_LENGTH
 
@@ -66,21 +81,36 @@ UNDEF = object()
 
 
 class Drop(metaclass=DropMeta):
+    __slots__ = ('_content', '_lines', '_from_content', 'name', 'conf', 'path')
     __registry__ = {}
 
     def __init__(self, name, init, conf=None, path=None):
-        if isinstance(init, (str, bytes)):
-            self.content = init
-            self.lines = self.encode(self.content)
+        # content and lines are converted lazily
+        self._from_content = isinstance(init, (str, bytes))
+        if self._from_content:
+            self._content = init
+            self._lines = None
         else:
-            self.lines = list(init)
-            self.content = self.decode(self.lines)
+            self._content = None
+            self._lines = list(init)
         self.name = name
         self.conf = conf or {}
         if path:
             path = Path(path)
         self.path = path
 
+    @property
+    def content(self):
+        if self._content is None:
+            self._content = self.decode(self._lines)
+        return self._content
+
+    @property
+    def lines(self):
+        if self._lines is None:
+            self._lines = self.encode(self._content)
+        return self._lines
+
     @property
     def formula(self):
         return self.conf.get('formula', None)
@@ -114,9 +144,21 @@ class Drop(metaclass=DropMeta):
     def get_lines(self):
         return self.lines
 
+    def get_encoded_lines(self):
+        if self._from_content:
+            # lines are produced by encode: reuse them
+            return self.get_lines()
+        return self.encode(self.get_content())
+
     def get_text(self):
         return ''.join(self.get_lines())
 
+    def lines_equal(self, other):
+        if type(self) is type(other) and self._lines is None and other._lines is None:
+            # both built from content, encoded the same way: no need to encode them
+            return self._content == other._content
+        return self.get_lines() == other.get_lines()
+
     def get_content(self):
         return self.content
 
@@ -142,9 +184,12 @@ class Drop(metaclass=DropMeta):
 
 
 class TextDrop(Drop):
+    __slots__ = ()
+
     @classmethod
     def encode(cls, content):
-        return [line + '\n' for line in content.split('\n')]
+        # str.splitlines would also split on '\r', '\f', ...: only '\n' ends a line here
+        return io.StringIO(content + '\n', newline='\n').readlines()
 
     @classmethod
     def decode(cls, lines):
@@ -156,23 +201,30 @@ class TextDrop(Drop):
 
 
 class BytesDrop(Drop):
+    __slots__ = ()
     __data_prefix__ = '#|'
+    __b85encode__ = staticmethod(base64.b85encode)
+    __b85decode__ = staticmethod(base64.b85decode)
 
     @classmethod
     def encode(cls, content):
-        lines = []
-        data = str(base64.b85encode(content), 'utf-8')
-        data_prefix = cls.__data_prefix__
+        data = memoryview(cls.__b85encode__(content))
+        data_prefix = bytes(cls.__data_prefix__, 'utf-8')
         dlen = max(get_max_line_length() - len(data_prefix), len(data_prefix) + 1)
+        # build all the encoded lines in a single buffer:
+        buf = bytearray()
         for index in range(0, len(data), dlen):
-            lines.append(f'{data_prefix}{data[index:index+dlen]}\n')
-        return lines
+            buf += data_prefix
+            buf += data[index:index+dlen]
+            buf += b'\n'
+        return str(buf, 'utf-8').splitlines(keepends=True)
 
     @classmethod
     def decode(cls, lines):
         data_prefix = cls.__data_prefix__
-        data = ''.join(line[len(data_prefix):].strip() for line in lines if line.startswith(data_prefix))
-        return base64.b85decode(data)
+        p_len = len(data_prefix)
+        data = ''.join([line[p_len:].strip() for line in lines if line.startswith(data_prefix)])
+        return cls.__b85decode__(data)
 
     @classmethod
     def class_drop_type(cls):
@@ -181,14 +233,20 @@ class BytesDrop(Drop):
     def _file_mode(self):
         return 'wb'
 
-    def untar(self, path, mode='r|*'):
+    def untar(self, path, mode='r:*'):
         path = self._build_path(path)
         b_file = io.BytesIO(self.get_content())
-        with tarfile.open(fileobj=b_file, mode=mode) as t_file:
+        t_kwargs = dict(TAR_COPY_KWARGS)
+        if '|' in mode:
+            # bufsize is used only in stream mode
+            t_kwargs['bufsize'] = TAR_BUFFER_SIZE
+        with tarfile.open(fileobj=b_file, mode=mode, **t_kwargs) as t_file:
             t_file.extractall(path)
 
 
 class Flask:
+    __slots__ = ('container', 'name', 'start', 'end', '_drop', 'conf', 'num_params', '_lines_cache')
+
     def __init__(self, container, name, start, end, conf=None):
         self.container = container
         self.name = name
@@ -197,6 +255,7 @@ class Flask:
         self._drop = None
         self.conf = dict(conf or {})
         self.num_params = len(self.conf)
+        self._lines_cache = {}
 
     def index_range(self, headers=False):
         if headers:
@@ -240,13 +299,24 @@ class Flask:
             raise DropError(f"{self.container.filename}@{line_index + 1}: unexpected drop conf")
         self.conf[key] = value
         self.num_params += 1
+        self._lines_cache.clear()
+
+    def invalidate(self):
+        """reset cached lines and drop after a container edit"""
+        self._lines_cache.clear()
+        self._drop = None
 
     def get_lines(self, headers=False):
-        if headers:
-            s_offset, e_offset = 0, 0
-        else:
-            s_offset, e_offset = self.num_params + 1, 1
-        return self.container.lines[self.start+s_offset:self.end-e_offset]
+        key = headers
+        lines = self._lines_cache.get(key, None)
+        if lines is None:
+            if headers:
+                s_offset, e_offset = 0, 0
+            else:
+                s_offset, e_offset = self.num_params + 1, 1
+            lines = self.container.lines[self.start+s_offset:self.end-e_offset]
+            self._lines_cache[key] = lines
+        return lines
 
     def get_text(self, headers=True):
         return '\n'.join(self.get_lines(headers=headers))
@@ -267,11 +337,16 @@ def get_file():
 
 
 class Pattern:
+    __slots__ = ('pattern', 'reverse', '_match', '_matches')
+
     def __init__(self, pattern, reverse=False):
         self.pattern = pattern
         self.reverse = reverse
+        self._match = re.compile(fnmatch.translate(os.path.normcase(pattern))).match
+        self._matches = {}
 
     @classmethod
+    @functools.lru_cache(maxsize=1024)
     def build(cls, value):
         if value.startswith('~'):
             reverse, pattern = True, value[1:]
@@ -280,7 +355,13 @@ class Pattern:
         return cls(pattern, reverse)
 
     def __call__(self, value):
-        return self.reverse != bool(fnmatch.fnmatch(value, self.pattern))
+        # matching is a pure function of value: cache it
+        matches = self._matches.get(value, None)
+        if matches is None:
+            # same as fnmatch.fnmatch, with a precompiled regex; unset values match as ''
+            text = '' if value is None else os.path.normcase(value)
+            matches = self._matches[value] = self._match(text) is not None
+        return self.reverse != matches
 
     def __str__(self):
         if self.reverse:
@@ -292,6 +373,7 @@ class Pattern:
 
 
 class DropFilter:
+    __slots__ = ('patterns', '_predicates')
     __regex__ = re.compile(r'(?P<op>[\^\:\/])?(?P<pattern>[^\^\:]+)\s*')
     __key_dict__ = {'': 'name', ':': 'drop_type', '^': 'formula', '/': 'path'}
 
@@ -307,8 +389,10 @@ class DropFilter:
             if not path.startswith('/'):
                 path = '*/' + path
             self.patterns.append(('path', Pattern.build(path), attrgetter('path')))
+        self._predicates = tuple((pattern, getter) for _, pattern, getter in self.patterns)
 
     @classmethod
+    @functools.lru_cache(maxsize=256)
     def build(cls, value):
         kwargs = {}
         for token in value.split():
@@ -317,7 +401,10 @@ class DropFilter:
         return cls(**kwargs)
 
     def __call__(self, drop):
-        return all(pattern(getter(drop)) for _,  pattern, getter in self.patterns)
+        for pattern, getter in self._predicates:
+            if not pattern(getter(drop)):
+                return False
+        return True
 
     def __repr__(self):
         args = ', '.join(f'{key}={pattern!r}' for key, pattern, _ in self.patterns)
@@ -328,20 +415,25 @@ class DropFilter:
         return ' '.join(key_rev[key] + str(pattern) for key, pattern, _ in self.patterns)
 
 
+PARSE_CACHE = {}
+PARSE_CACHE_SIZE = 64
+
+
 class Container(Mapping):
-    __re_drop__ = r'\# drop:\s+(?P<action>start|end)\s+(?P<name>[^\s\/\:]+)'
-    __re_conf__ = r'\# drop:\s+-\s+(?P<key>\w+)\s*=\s*(?P<value>.*)\s*$'
+    __re_directive__ = (
+        r'\# drop:[^\S\n]+(?:'
+        r'(?P<action>start|end)[^\S\n]+(?P<name>[^\s\/\:]+)'
+        r'|-[^\S\n]+(?P<key>\w+)[^\S\n]*=[^\S\n]*(?P<value>.*))')
+    _re_directive = re.compile(__re_directive__)
 
     def __init__(self, file=None, lines=None):
         if file is None:
             file = get_file()
-            path = None
         if isinstance(file, (str, Path)):
-            path = Path(file)
+            path = file if isinstance(file, Path) else Path(file)
             if lines is None:
-                if isinstance(file, (str, Path)):
-                    with open(file, 'r') as fh:
-                        lines = fh.readlines()
+                with open(path, 'r', buffering=IO_BUFFER_SIZE) as fh:
+                    lines = fh.readlines()
         else:
             path = getattr(file, 'name', None)
             if path:
@@ -358,23 +450,38 @@ class Container(Mapping):
     def filter(self, drop_filters):
         if drop_filters is None:
             drop_filters = []
-        drops = list(self.values())
+        drops = list(self.flasks.values())
         for drop_filter in drop_filters:
-            new_drops = []
-            for drop in drops:
-                if drop_filter(drop):
-                    new_drops.append(drop)
-            drops = new_drops
+            drops = [drop for drop in drops if drop_filter(drop)]
             if not drops:
                 break
         selected_names = {drop.name for drop in drops}
-        return [name for name in self if name in selected_names]
+        return [name for name in self.flasks if name in selected_names]
 
     def _parse_lines(self):
+        # parse results are shared among containers with the same lines
+        key = (self.filename, tuple(self.lines))
+        records = PARSE_CACHE.get(key, None)
+        if records is None:
+            self._parse_flasks()
+            records = [(flask.name, flask.start, flask.end, dict(flask.conf), flask.num_params)
+                       for flask in self.flasks.values()]
+            if len(PARSE_CACHE) >= PARSE_CACHE_SIZE:
+                # discard the oldest entry
+                del PARSE_CACHE[next(iter(PARSE_CACHE))]
+            PARSE_CACHE[key] = records
+        else:
+            for name, start, end, conf, num_params in records:
+                flask = Flask(self, name=name, start=start, end=end, conf=conf)
+                # repeated conf keys take more lines than conf items
+                flask.num_params = num_params
+                self.flasks[name] = flask
+
+    def _parse_flasks(self):
         filename = self.filename
         lines = self.lines
-        re_drop = re.compile(self.__re_drop__)
-        re_conf = re.compile(self.__re_conf__)
+        re_directive = self._re_directive
+        json_loads = json.loads
         flasks = self.flasks
 
         flask = None
@@ -387,11 +494,22 @@ class Container(Mapping):
                 flasks[flask.name] = flask
                 flask = None
 
-        for cur_index, line in enumerate(lines):
-            m_drop = re_drop.match(line)
-            if m_drop:
+        # scan the whole text at once; line_starts maps matches to line indices
+        text = ''.join(lines)
+        if '# drop:' not in text:
+            # no directives at all
+            return
+        line_starts = [0]
+        line_starts.extend(itertools.accumulate(len(line) for line in lines))
+        for match in re_directive.finditer(text):
+            m_start = match.start()
+            cur_index = bisect.bisect_right(line_starts, m_start) - 1
+            if line_starts[cur_index] != m_start:
+                # directive not at the beginning of the line
+                continue
+            if match['action']:
                 cur_action, cur_name = (
-                    m_drop['action'], m_drop['name'])
+                    match['action'], match['name'])
                 if cur_action == 'end':
                     if flask and cur_name == flask.name:
                         _store_flask(cur_index)
@@ -408,17 +526,15 @@ class Container(Mapping):
                     continue
                 continue
 
-            m_conf = re_conf.match(line)
-            if m_conf:
-                if flask is None:
-                    raise DropError(f"{filename}@{cur_index + 1}: unexpected parameter {m_conf['key']}={m_conf['value']}")
-                key = m_conf['key']
-                serialized_value = m_conf['value']
-                try:
-                    value = json.loads(serialized_value)
-                except Exception as err:
-                    raise DropError(f"{filename}@{cur_index + 1}: conf key {key}={serialized_value!r}: {type(err).__name__}: {err}")
-                flask.merge_conf(cur_index, key, value)
+            if flask is None:
+                raise DropError(f"{filename}@{cur_index + 1}: unexpected parameter {match['key']}={match['value']}")
+            key = match['key']
+            serialized_value = match['value']
+            try:
+                value = json_loads(serialized_value)
+            except Exception as err:
+                raise DropError(f"{filename}@{cur_index + 1}: conf key {key}={serialized_value!r}: {type(err).__name__}: {err}")
+            flask.merge_conf(cur_index, key, value)
 
         if flask:
             _store_flask(None)
@@ -449,14 +565,16 @@ class Container(Mapping):
 
 CONTAINER_CACHE = {}
 def get_container(file=None):
-    """get Container instance (cached)"""
+    """get Container instance (cached, reloaded if the file changes)"""
     if file is None:
         file = __file__
     file = Path(file).resolve()
-    container = CONTAINER_CACHE.get(file, None)
-    if container is None:
+    f_stat = file.stat()
+    stamp = (f_stat.st_mtime_ns, f_stat.st_size)
+    cached_stamp, container = CONTAINER_CACHE.get(file, (None, None))
+    if container is None or cached_stamp != stamp:
         container = Container(file)
-        CONTAINER_CACHE[file] = container
+        CONTAINER_CACHE[file] = (stamp, container)
     return container
 
 
@@ -5,7 +5,7 @@ import os
 from pathlib import Path
 from urllib.parse import urlparse
 
-from .drop import DropError, Drop
+from .drop import DropError, Drop, TAR_COPY_KWARGS
 from . import api
 
 
@@ -133,10 +133,10 @@ class PathFormula(Formula):
     def __init__(self, base_dir, path, name=None, drop_type=None):
         self._orig_path = path
         self.base_dir = Path(base_dir)
-        path = Path(path)
-        if not path.is_absolute():
-            path = base_dir / path
-        self.path = Path(os.path.normpath(str(path)))
+        path = os.fspath(path)
+        if not os.path.isabs(path):
+            path = os.path.join(self.base_dir, path)
+        self.path = Path(os.path.normpath(path))
         self._check_path()
         super().__init__(name=name, drop_type=drop_type)
 
@@ -206,6 +206,39 @@ class SourceFormula(FileFormula):
         return 'text'
 
 
+class _GzipWriter:
+    """write-only file object compressing to gzip format
+
+    The header is fixed (mtime 0, XFL 2, OS 0xff, as written by GzipFile
+    with compresslevel 9), so that output does not depend on the python
+    version or on the platform zlib.
+    """
+    HEADER = b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x02\xff'
+
+    def __init__(self, fileobj, compresslevel=9):
+        import zlib
+        self.fileobj = fileobj
+        self.compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -zlib.MAX_WBITS)
+        self.crc32 = zlib.crc32
+        self.crc = 0
+        self.offset = 0
+        self.fileobj.write(self.HEADER)
+
+    def write(self, data):
+        self.crc = self.crc32(data, self.crc)
+        self.offset += len(data)
+        self.fileobj.write(self.compressor.compress(data))
+        return len(data)
+
+    def tell(self):
+        return self.offset
+
+    def close(self):
+        import struct
+        self.fileobj.write(self.compressor.flush())
+        self.fileobj.write(struct.pack('<LL', self.crc, self.offset & 0xffffffff))
+
+
 class DirFormula(PathFormula):
     def __init__(self, base_dir, path, arcname=None, name=None, drop_type=None):
         super().__init__(base_dir, path, name=name, drop_type=drop_type)
@@ -222,13 +255,15 @@ class DirFormula(PathFormula):
         super()._check_path()
 
     def content(self):
-        import gzip
         import io
         import tarfile
         bf = io.BytesIO()
-        with tarfile.open(fileobj=bf, mode='w') as tf:
+        # stream the tar through the compressor: mtime=0 makes compressed data reproducible!
+        gw = _GzipWriter(bf)
+        with tarfile.open(fileobj=gw, mode='w', **TAR_COPY_KWARGS) as tf:
             tf.add(self.path, arcname=self.arcname)
-        return gzip.compress(bf.getvalue(), mtime=0.0)  # make compressed data reproducible!
+        gw.close()
+        return bf.getvalue()
 
     @classmethod
     def parse_conf(cls, base_dir, filename, data):
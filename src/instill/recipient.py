@@ -1,4 +1,5 @@
 import abc
+import bisect
 import functools
 import itertools
 import json
@@ -15,7 +16,7 @@ import yaml
 from .color import colored, Console, C
 from .formula import Formula, FormulaParseError
 from .log import LOG
-from .drop import DropError, Container, Drop, Flask, DropFilter
+from .drop import DropError, Container, Drop, Flask, DropFilter, IO_BUFFER_SIZE
 from .util import diff_files
 
 __all__ = [
@@ -29,6 +30,13 @@ def h_name(text):
     # return C.xxi(text)
 
 
+@functools.lru_cache(maxsize=1024, typed=True)
+def _conf_line(key, value):
+    """serialized drop conf line (cached: most conf items recur across drops and rewrites)"""
+    serialized_value = json.dumps(value)
+    return f'# drop: - {key}={serialized_value}\n'
+
+
 class Position(abc.ABC):
     @abc.abstractmethod
     def __call__(self, drop_file):
@@ -65,13 +73,13 @@ class _Relative(Position):
 class Before(_Relative):
     def __call__(self, drop_file):
         flasks = self.filtered_flasks(drop_file)
-        return min(flask.start for flask in self.filtered_flasks(drop_file))
+        return min(flask.start for flask in flasks)
 
 
 class After(_Relative):
     def __call__(self, drop_file):
         flasks = self.filtered_flasks(drop_file)
-        return max(flask.end for flask in self.filtered_flasks(drop_file))
+        return max(flask.end for flask in flasks)
 
 
 class AtLine(Position):
@@ -89,6 +97,9 @@ class MutableContainer(MutableMapping, Container):
 
     def _update_lines(self, l_start, l_diff):
         for flask in self.flasks.values():
+            if flask.end > l_start:
+                # lines before l_start are unchanged, caches of flasks ending there are still valid
+                flask.invalidate()
             if flask.start >= l_start:
                 flask.start += l_diff
                 flask.end += l_diff
@@ -99,6 +110,7 @@ class MutableContainer(MutableMapping, Container):
     def del_drop(self, name, content_only=False):
         if content_only:
             flask = self.flasks[name]
+            flask.invalidate()
             start, end = flask.index_range(headers=False)
         else:
             flask = self.flasks.pop(name)
@@ -107,6 +119,43 @@ class MutableContainer(MutableMapping, Container):
         self._update_lines(flask.start, -(end - start))
         self.content_version += 1
 
+    def del_drops_batch(self, names, content_only=False):
+        """delete many drops at once, rebuilding lines in a single pass"""
+        ranges = []
+        for name in names:
+            if content_only:
+                flask = self.flasks[name]
+                flask.invalidate()
+                ranges.append(flask.index_range(headers=False))
+            else:
+                flask = self.flasks.pop(name)
+                ranges.append(flask.index_range(headers=True))
+        if not ranges:
+            return
+        ranges.sort()
+        lines = self.lines
+        new_lines = []
+        prev = 0
+        r_starts = []
+        r_deleted = [0]  # r_deleted[i]: number of lines deleted by the first i ranges
+        for start, end in ranges:
+            if end <= start:
+                # nothing to delete (e.g. content of a drop without end marker)
+                continue
+            new_lines.extend(lines[prev:start])
+            prev = end
+            r_starts.append(start)
+            r_deleted.append(r_deleted[-1] + end - start)
+        new_lines.extend(lines[prev:])
+        self.lines = new_lines
+        for flask in self.flasks.values():
+            e_index = bisect.bisect_left(r_starts, flask.end)
+            if e_index:
+                flask.invalidate()
+                flask.start -= r_deleted[bisect.bisect_left(r_starts, flask.start)]
+                flask.end -= r_deleted[e_index]
+        self.content_version += 1
+
     def __setitem__(self, name, drop):
         self.set_drop(name, drop)
 
@@ -121,7 +170,7 @@ class MutableContainer(MutableMapping, Container):
         if empty:
             content_lines = None
         else:
-            content_lines = drop.encode(drop.get_content())
+            content_lines = drop.get_encoded_lines()
 
         self.content_version += 1
         deleted_flask = self.flasks.get(name, None)
@@ -155,8 +204,11 @@ class MutableContainer(MutableMapping, Container):
     def get_drop_lines(self, name, conf, content_lines):
         drop_lines = [f'# drop: start {name}\n']
         for key, value in conf.items():
-            serialized_value = json.dumps(value)
-            drop_lines.append(f'# drop: - {key}={serialized_value}\n')
+            try:
+                drop_lines.append(_conf_line(key, value))
+            except TypeError:
+                # unhashable value (list, dict)
+                drop_lines.append(_conf_line.__wrapped__(key, value))
         if content_lines is not None:
             drop_lines.extend(content_lines)
         drop_lines.append(f'# drop: end {name}\n')
@@ -170,18 +222,20 @@ class Recipient(MutableContainer):
             self.base_dir = Path.cwd()
         else:
             self.base_dir = Path(os.path.normpath(str(self.path.parent.absolute())))
-        self.__cached_formulae = None
-        # self.__parse_formulae()
+        self._cached_formulae = {}
 
     def relocate(self, output_path):
-        lines = self.lines[:]
+        lines = self.lines
         out_base_dir = output_path.parent
-        flask_items = sorted(self.items(), key=lambda x: x[1].start)
-        offset = 0
+        flask_items = sorted(self.flasks.items(), key=lambda x: x[1].start)
+        get_formula = self.get_formula
+        # splice untouched segments and rebuilt drops in a single pass
+        out_lines = []
+        prev = 0
         for name, flask in flask_items:
             content_lines = flask.get_lines(headers=False)
             # reparse flask conf:
-            formula = self.get_formula(name)
+            formula = get_formula(name)
             conf = formula.parse_conf(self.base_dir, output_path, flask.conf)
             # relocate parsed conf:
             conf = formula.relocate_conf(out_base_dir, output_path, conf)
@@ -190,21 +244,32 @@ class Recipient(MutableContainer):
             conf = r_formula.conf()
             # rewrite drop lines:
             drop_lines = self.get_drop_lines(name=name, conf=conf, content_lines=content_lines)
-            lines[offset + flask.start:offset + flask.end] = drop_lines
-            offset += len(drop_lines) - (flask.end - flask.start)
-        return Recipient(output_path, lines=lines)
+            out_lines.extend(lines[prev:flask.start])
+            out_lines.extend(drop_lines)
+            prev = flask.end
+        out_lines.extend(lines[prev:])
+        return Recipient(output_path, lines=out_lines)
 
     @contextmanager
     def refactor(self, output_path=None, force_rewrite=False, mode=None):
         if self.path is None:
             raise DropError('{self}: path is not set')
-        content_version = self.content_version
-        yield
         if output_path is None:
             output_path = self.path
         else:
             output_path = Path(output_path)
-        if output_path.resolve() != self.path.resolve():
+        if output_path is self.path or output_path == self.path:
+            same_path = True
+        else:
+            same_path = output_path.resolve() == self.path.resolve()
+        content_version = self.content_version
+        if same_path and not force_rewrite:
+            # snapshot only for the no-op check below
+            orig_lines = self.lines[:]
+        else:
+            orig_lines = None
+        yield
+        if not same_path:
             # out ot place, container must be relocated!
             container = self.relocate(output_path)
             if mode is None:
@@ -217,45 +282,51 @@ class Recipient(MutableContainer):
             return
 
         write = True
-        if (not force_rewrite) and content_version == self.content_version:
-            write = False
+        if not force_rewrite:
+            if content_version == self.content_version:
+                write = False
+            elif self.lines == orig_lines:
+                # changes cancelled out (e.g. drop replaced with the same lines)
+                write = False
         if write:
             if mode is None and self.path.is_file():
                 mode = self.path.stat().st_mode
             output_path.parent.mkdir(parents=True, exist_ok=True)
-            with open(output_path, 'w') as fh:
-                fh.writelines(self.lines)
+            with open(output_path, 'w', buffering=IO_BUFFER_SIZE) as fh:
+                # a single write lets the encoder process the whole text at once
+                fh.write(''.join(self.lines))
             if mode is not None:
                 output_path.chmod(mode)
 
-    def __parse_formulae(self):
-        if self.__cached_formulae is None:
-            console = Console()
-            errors = 0
-            self.__cached_formulae = {}
-            for name, flask in self.items():
-                formula_name = flask.formula
-                if formula_name is None:
-                    console.error(f'drop {C.xxb(name)}: formula not set')
-                    errors += 1
-                    continue
-                try:
-                    formula_class = Formula.formula_class(flask.formula)
-                    parsed_conf = formula_class.parse_conf(self.base_dir, self.path, flask.conf)
-                    formula = formula_class(name=flask.name, **parsed_conf)
-                    self.__cached_formulae[name] = formula
-                except Exception as err:
-                    console.error(f'drop {C.xxb(name)}: cannot create formula {C.xxb(flask.formula)}: {C.rxb(type(err).__name__)}: {C.rxx(str(err))}')
-                    errors += 1
-                    continue
-                if formula is not None:
-                    formula.fix_conf(flask.conf)
+    def _parse_formula(self, name):
+        flask = self.flasks[name]
+        console = Console()
+        formula_name = flask.formula
+        if formula_name is None:
+            console.error(f'drop {C.xxb(name)}: formula not set')
+            return None
+        try:
+            formula_class = Formula.formula_class(flask.formula)
+            parsed_conf = formula_class.parse_conf(self.base_dir, self.path, flask.conf)
+            formula = formula_class(name=flask.name, **parsed_conf)
+        except Exception as err:
+            console.error(f'drop {C.xxb(name)}: cannot create formula {C.xxb(flask.formula)}: {C.rxb(type(err).__name__)}: {C.rxx(str(err))}')
+            return None
+        formula.fix_conf(flask.conf)
+        return formula
 
     def get_formula(self, name):
-        self.__parse_formulae()
-        if name not in self.__cached_formulae:
+        # formulae are parsed lazily, one drop at a time
+        cached_formulae = self._cached_formulae
+        if name in cached_formulae:
+            formula = cached_formulae[name]
+        elif name not in self.flasks:
+            formula = None
+        else:
+            formula = cached_formulae[name] = self._parse_formula(name)
+        if formula is None:
             raise DropError(f'drop {name}: formula not available')
-        return self.__cached_formulae[name]
+        return formula
 
     def abs_path(self, path):
         path = Path(path)
@@ -294,8 +365,7 @@ class Recipient(MutableContainer):
         LOG.info(f'{source_rel_path} -> {target_rel_path}')
         with self.refactor(target_path):
             names = self.filter(filters)
-            for name in names:
-                self.del_drop(name, content_only=content_only)
+            self.del_drops_batch(names, content_only=content_only)
 
     def update(self, output_file=None, filters=None, stream=sys.stdout, info_level=0):
         console = Console(stream=stream, info_level=info_level)
@@ -304,37 +374,34 @@ class Recipient(MutableContainer):
         LOG.info(f'{source_rel_path} -> {target_rel_path}')
         with self.refactor(target_path):
             if filters:
-                included_names = self.filter(filters)
-                excluded_names = set(self).difference(included_names)
-                # print(filters, included_names, excluded_names)
+                included_names = set(self.filter(filters))
             else:
-                excluded_names = set()
-            for name, flask in list(self.items()):
-                formula = self.get_formula(name)
+                included_names = None
+            get_formula = self.get_formula
+            flasks = self.flasks
+            # set_drop mutates flasks: iterate on a snapshot of the names
+            for name in tuple(flasks):
+                flask = flasks.get(name, None)
+                if flask is None:
+                    continue
+                formula = get_formula(name)
                 formula.fix_conf(flask.conf)
-                if name not in self or name not in excluded_names:
-                    console.print(h_name(name), end=' ')
+                if included_names is None or name in included_names:
+                    # one print (and flush) per status line
+                    h_text = h_name(name)
                     try:
                         e_drop = formula()
                         if name in self:
                             if flask.is_set():
                                 f_drop = flask.drop
-                                if f_drop.get_lines() == e_drop.get_lines():
-                                    console.print(C.Cxb('skipped'))
+                                if f_drop.lines_equal(e_drop):
+                                    console.print(f'{h_text} {C.Cxb("skipped")}')
                                     continue
                         self.set_drop(name, e_drop, empty=False)
-                        console.print(C.Gxb('added'))
+                        console.print(f'{h_text} {C.Gxb("added")}')
                     except:
-                        console.print(C.Rxb('add failed!'))
+                        console.print(f'{h_text} {C.Rxb("add failed!")}')
                         raise
-            for discarded_name in set(self).difference(self):  # FIXME - useless
-                console.print(h_name(name), end=' ')
-                try:
-                    del self[discarded_name]
-                    console.print(C.gxx('removed'))
-                except:
-                    console.print(C.rxx('remove failed!'))
-                    raise
 
     def status(self, stream=sys.stdout, info_level=0, filters=None):
         console = Console(stream=stream, info_level=info_level)
@@ -342,29 +409,33 @@ class Recipient(MutableContainer):
             console.error(f'file {self.path} is missing')
             return
         names = self.filter(filters)
+        get_formula = self.get_formula
+        flasks = self.flasks
         for name in names:
-            formula = self.get_formula(name)
-            flask = self[name]
+            formula = get_formula(name)
+            flask = flasks[name]
             formula.fix_conf(flask.conf)
-            console.print(h_name(name), end=' ')
+            h_text = h_name(name)
             if not flask.is_set():
-                console.print(f'{C.Yxb("not-set")}')
+                console.print(f'{h_text} {C.Yxb("not-set")}')
                 continue
             try:
                 f_drop = flask.drop
-                f_lines = f_drop.get_lines()
             except Exception as err:
-                f_lines = []
+                f_drop = None
             try:
                 e_drop = formula()
-                e_lines = e_drop.get_lines()
+                if f_drop is None:
+                    up_to_date = not e_drop.get_lines()
+                else:
+                    up_to_date = f_drop.lines_equal(e_drop)
             except Exception as err:
-                console.print(f'{C.Rxb("drop load error")}: {type(err).__name__}: {err}')
+                console.print(f'{h_text} {C.Rxb("drop load error")}: {type(err).__name__}: {err}')
                 continue
-            if f_lines != e_lines:
-                console.print(f'{C.Rxb("out-of-date")}')
+            if not up_to_date:
+                console.print(f'{h_text} {C.Rxb("out-of-date")}')
             else:
-                console.print(f'{C.Gxb("up-to-date")}')
+                console.print(f'{h_text} {C.Gxb("up-to-date")}')
 
     def diff(self, stream=sys.stdout, info_level=0, filters=None, binary=False):
         console = Console(stream=stream, info_level=info_level)
@@ -372,12 +443,14 @@ class Recipient(MutableContainer):
             console.error(f'file {rel_path} is missing')
             return
         names = self.filter(filters)
+        get_formula = self.get_formula
+        flasks = self.flasks
         for name in names:
-            formula = self.get_formula(name)
-            flask = self[name]
+            formula = get_formula(name)
+            flask = flasks[name]
             formula.fix_conf(flask.conf)
             start, end = flask.index_range(headers=False)
-            console.print(h_name(name), end=' ')
+            h_text = h_name(name)
             if flask.is_set():
                 try:
                     f_drop = flask.drop
@@ -390,24 +463,24 @@ class Recipient(MutableContainer):
                 e_drop = formula()
                 e_lines = e_drop.get_lines()
             except Exception as err:
-                console.print(f'{C.Rxb("drop load error")}: {type(err).__name__}: {err}')
+                console.print(f'{h_text} {C.Rxb("drop load error")}: {type(err).__name__}: {err}')
                 continue
             if f_lines != e_lines:
-                console.print(f'{C.Rxb("out-of-date")}')
+                console.print(f'{h_text} {C.Rxb("out-of-date")}')
                 if (not binary) and flask.drop_type == 'bytes':
                     console.print(C.Rxb('(binary diff)'))
                 else:
-                    all_f_lines = list(self.lines)
-                    all_e_lines = list(self.lines)
-                    all_f_lines[start:] = f_lines
-                    all_e_lines[start:] = e_lines
+                    # difflib needs sequences: share the head, do not copy the tail
+                    head = self.lines[:start]
+                    all_f_lines = head + f_lines
+                    all_e_lines = head + e_lines
                     diff_files(f'found', f'expected', all_f_lines, all_e_lines,
                                stream=stream,
                                num_context_lines=3,
                                # indent='    ',
                     )
             else:
-                console.print(f'{C.Gxb("up-to-date")}')
+                console.print(f'{h_text} {C.Gxb("up-to-date")}')
 
     def show_drop_conf(self, stream=sys.stdout, filters=None):
         console = Console(stream=stream)
@@ -426,8 +499,10 @@ class Recipient(MutableContainer):
             flask = self[name]
             drop = flask.drop
             offset = flask.start
-            for index, line in enumerate(drop.get_lines()):
-                console.print(f'    {index + offset:6d}| {C.xxi(line)}', end='')
+            # print all the drop lines at once
+            fmt = '    {:6d}| {}'.format
+            buf = [fmt(index + offset, C.xxi(line)) for index, line in enumerate(drop.get_lines())]
+            console.print(''.join(buf), end='')
 
     def list_drops(self, stream=sys.stdout, show_header=True, filters=None):
         console = Console(stream=stream)
@@ -438,12 +513,16 @@ class Recipient(MutableContainer):
             formula = flask.formula or ''
             num_chars = len(flask.get_text())
             table.append([flask.name, flask.drop_type or '', formula or '',
-                          f'{flask.start+1}:{flask.end+1}', str(num_chars)])
+                          '%d:%d' % (flask.start + 1, flask.end + 1), str(num_chars)])
         if table:
             if show_header:
                 names.insert(0, None)
                 table.insert(0, ['name', 'type', 'formula', 'lines', 'size'])
-            mlen = [max(len(row[c]) for row in table) for c in range(len(table[0]))]
+            mlen = [0] * len(table[0])
+            for row in table:
+                for c, cell in enumerate(row):
+                    if len(cell) > mlen[c]:
+                        mlen[c] = len(cell)
             if show_header:
                 names.insert(1, None)
                 table.insert(1, ['─' * ml for ml in mlen])
@@ -163,6 +163,29 @@ def fn_drop_show(input_file, show_target, filters):
     function(filters=filters)
 
 
+def signature_parameters(function):
+    return tuple(
+        (p_name, p_obj.default is p_obj.empty)
+        for p_name, p_obj in inspect.signature(function).parameters.items()
+    )
+
+
+# the dispatch table is fixed: inspect the fn_drop_* signatures only once
+FUNCTION_PARAMETERS = {
+    function: signature_parameters(function)
+    for function in (
+        fn_drop_update,
+        fn_drop_extract,
+        fn_drop_set,
+        fn_drop_del,
+        fn_drop_status,
+        fn_drop_diff,
+        fn_drop_list,
+        fn_drop_show,
+    )
+}
+
+
 def add_common_arguments(parser):
     parser.add_argument(
         '--trace',
@@ -184,11 +207,21 @@ def add_common_arguments(parser):
         **v_kwargs)
 
 
-def build_parser(name, *, subparsers=None, function=None, **kwargs):
+class FastPathError(Exception):
+    pass
+
+
+class FastPathParser(argparse.ArgumentParser):
+    """parser for the fast path: errors are reported by the full parser"""
+    def error(self, message):
+        raise FastPathError(message)
+
+
+def build_parser(name, *, subparsers=None, function=None, parser_class=argparse.ArgumentParser, **kwargs):
     if subparsers:
         parser = subparsers.add_parser(name, **kwargs)
     else:
-        parser = argparse.ArgumentParser(name, **kwargs)
+        parser = parser_class(name, **kwargs)
         add_common_arguments(parser)
     if function is None:
         function = parser.print_help
@@ -210,16 +243,7 @@ class InputFileType:
         return InputFile(file_type=self.file_type, file_name=file_name)
 
 
-def build_instill_parser(subparsers=None):
-    parser = build_parser(
-        name='instill',  subparsers=subparsers,
-        description=f'''\
-instill {get_version()} - add drops of data to source files
-'''
-    )
-    subparsers = parser.add_subparsers()
-
-    ### list
+def build_list_parser(subparsers):
     list_parser = build_parser(
         'list', subparsers=subparsers,
         function=fn_drop_list,
@@ -233,8 +257,10 @@ instill {get_version()} - add drops of data to source files
         action='store_false',
         default=True,
         help='do not show table header lines')
+    return list_parser
+
 
-    ### show
+def build_show_parser(subparsers):
     show_parser = build_parser(
         'show', subparsers=subparsers,
         function=fn_drop_show,
@@ -254,8 +280,10 @@ instill {get_version()} - add drops of data to source files
         action='store_const', const='lines',
         help='show drop lines',
         **target_kwargs)
+    return show_parser
 
-    ### update
+
+def build_update_parser(subparsers):
     update_parser = build_parser(
         'update', subparsers=subparsers,
         function=fn_drop_update,
@@ -267,8 +295,10 @@ instill {get_version()} - add drops of data to source files
         '-m', '--max-line-length',
         default=None,
         help='set max data line length')
+    return update_parser
+
 
-    ### extract
+def build_extract_parser(subparsers):
     extract_parser = build_parser(
         'extract', subparsers=subparsers,
         function=fn_drop_extract,
@@ -276,8 +306,10 @@ instill {get_version()} - add drops of data to source files
     add_input_argument(extract_parser)
     add_output_argument(extract_parser, optional=False)
     add_name_argument(extract_parser)
+    return extract_parser
+
 
-    ### add
+def build_set_parser(subparsers):
     set_parser = build_parser(
         'set', subparsers=subparsers,
         function=fn_drop_set,
@@ -370,8 +402,10 @@ instill {get_version()} - add drops of data to source files
         '-r', '--replace',
         action='store_true', default=False,
         help='replace existing drop with the same name')
+    return set_parser
 
-    ### del
+
+def build_del_parser(subparsers):
     del_parser = build_parser(
         'del', subparsers=subparsers,
         function=fn_drop_del,
@@ -383,16 +417,20 @@ instill {get_version()} - add drops of data to source files
         '-c', '--content-only',
         action='store_true', default=False,
         help='remove only drop content')
+    return del_parser
+
 
-    ### status:
+def build_status_parser(subparsers):
     status_parser = build_parser(
         'status', subparsers=subparsers,
         function=fn_drop_status,
         description='show the source file status')
     add_input_argument(status_parser)
     add_filters_argument(status_parser)
+    return status_parser
 
-    ### diff:
+
+def build_diff_parser(subparsers):
     diff_parser = build_parser(
         'diff', subparsers=subparsers,
         function=fn_drop_diff,
@@ -403,23 +441,53 @@ instill {get_version()} - add drops of data to source files
         '-b', '--binary',
         action='store_true', default=False,
         help='show diff in encoded binary drops')
+    return diff_parser
+
+
+SUBCOMMAND_PARSERS = {
+    'list': build_list_parser,
+    'show': build_show_parser,
+    'update': build_update_parser,
+    'extract': build_extract_parser,
+    'set': build_set_parser,
+    'del': build_del_parser,
+    'status': build_status_parser,
+    'diff': build_diff_parser,
+}
+
 
+def build_instill_parser(subparsers=None, commands=None, parser_class=argparse.ArgumentParser):
+    parser = build_parser(
+        name='instill',  subparsers=subparsers, parser_class=parser_class,
+        description=f'''\
+instill {get_version()} - add drops of data to source files
+'''
+    )
+    subparsers = parser.add_subparsers()
+    if commands is None:
+        commands = SUBCOMMAND_PARSERS
+    for command in commands:
+        SUBCOMMAND_PARSERS[command](subparsers)
     return parser
 
 
-def runner(parser):
+def runner(parser, ns=None):
     ### parsing:
-    ns = parser.parse_args()
+    if ns is None:
+        ns = parser.parse_args()
     set_trace(ns.trace)
     configure_logging(ns.verbose_level)
 
     ns_vars = vars(ns)
     function = ns.function
     f_args = {}
-    for p_name, p_obj in inspect.signature(function).parameters.items():
+    f_parameters = FUNCTION_PARAMETERS.get(function, None)
+    if f_parameters is None:
+        f_parameters = signature_parameters(function)
+    for p_name, p_required in f_parameters:
         if p_name in ns_vars:
             f_args[p_name] = ns_vars[p_name]
-        elif p_obj.default is p_obj.empty:
+        elif p_required:
             raise RuntimeError(f'internal error: {function.__name__}: missing argument {p_name}')
     with trace_errors(function.__name__, on_error='exit'):
         result = function(**f_args)
@@ -428,6 +496,27 @@ def runner(parser):
     sys.exit(1)
 
 
+def get_command(args):
+    for arg in args:
+        if arg in {'-h', '--help'}:
+            return None
+        if not arg.startswith('-'):
+            return arg
+    return None
+
+
 def main():
+    # fast path: build only the parser of the requested subcommand
+    command = get_command(sys.argv[1:])
+    if command in SUBCOMMAND_PARSERS:
+        parser = build_instill_parser(commands=[command], parser_class=FastPathParser)
+        try:
+            ns = parser.parse_args()
+        except FastPathError:
+            # let the full parser report the error (complete usage)
+            pass
+        else:
+            runner(parser, ns)
+            return
     parser = build_instill_parser()
     runner(parser)